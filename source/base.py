@@ -9,6 +9,14 @@ from boto3.dynamodb.conditions import Key
 from time import sleep
 import json
 import copy
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
 import hashlib
 import re
 
@@ -27,9 +35,13 @@ TTL_FILE_OLD = '/tmp/curation-export-old.ttl'
 TTL_FILE_NEW = '/tmp/curation-export-new.ttl'
 TTL_FILE_DIFF = '/tmp/curation-export-diff.ttl'
 SPARC_DATASET_ID = 'N:dataset:bed6add3-09c0-4834-b129-c3b406240f3d'
+AWARD_CACHE_FILE = '/tmp/award_cache'
+AWARD_CACHE_TTL = 30 * 24 * 3600 # seconds
+AWARD_CACHE_MISS_TTL = 24 * 3600 # seconds, for awards that could not be found
+AWARD_CACHE_ERROR_TTL = 3600 # seconds, for failed award lookups
 
-# List of properties which have multiple values:
-arrayProps = [
+# Set of properties which have multiple values:
+arrayProps = frozenset([
     'http://purl.obolibrary.org/obo/IAO_0000136',
     'hasExperimentalModality',
     'hasAffiliation',
@@ -55,20 +67,20 @@ arrayProps = [
     'hasFolderAboutIt',
     'hasAdditionalFundingInformation',
     'isDescribedBy',
-    'completenessOfDataset']
+    'completenessOfDataset'])
 
 ### Helper functions ###
 
+URL_RE = re.compile(
+    r'^(?:http|ftp)s?://' # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
+    r'localhost|' #localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
+    r'(?::\d+)?' # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
 def validate_orcid_url(orcid):
-    regex = re.compile(
-        r'^(?:http|ftp)s?://' # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
-        r'localhost|' #localhost...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
-        r'(?::\d+)?' # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-
-    if re.match(regex, "http://www.example.com") is not None:
+    if URL_RE.match("http://www.example.com") is not None:
         return orcid
     else:
         return "https://orcid.org/{}".format(orcid)
@@ -129,7 +141,7 @@ def parse_unit_value(node, name, model_unit = 'None', is_num=True):
 
     # Check if node name exists
     if not name in node:
-        log.warning('No value for {}'.format(name))
+        log.warning('No value for %s', name)
         return None
 
     # Check is coded as unit or string
@@ -145,7 +157,7 @@ def parse_unit_value(node, name, model_unit = 'None', is_num=True):
 
     # Validate that unit matches Model Unit.
     if unit != model_unit:
-        log.warning('Unit mismatch between record and model {} - {}'.format(unit, model_unit))
+        log.warning('Unit mismatch between record and model %s - %s', unit, model_unit)
 
     if is_num:
         try:
@@ -165,13 +177,18 @@ def parse_unit_value(node, name, model_unit = 'None', is_num=True):
     return value
 
 def get_as_list(subNode, key):
-    value = None
-    if key in subNode:
-        if isinstance(subNode.get(key), list):
-            value = subNode.get(key)
-        else:
-            value = [subNode.get(key)]
-    return value
+    'Return subNode[key] as a list, or None if key is missing'
+    try:
+        value = subNode[key]
+    except KeyError:
+        return None
+    # Values from the JSON file are plain lists, so skip the isinstance MRO walk
+    if type(value) is list:
+        return value
+    return [value]
+
+NAMED_INDIVIDUAL = URIRef('http://www.w3.org/2002/07/owl#NamedIndividual')
+RDFS_LABEL = URIRef('http://www.w3.org/2000/01/rdf-schema#label')
 
 def iri_lookup(g, iri, iriCache=None):
     'Retrieve data about a SPARC term'
@@ -191,15 +208,20 @@ def iri_lookup(g, iri, iriCache=None):
     if iriCache is None:
         iriCache = {}
 
+    if iri in iriCache:
+        log.debug('Returning cached IRI: %s', iri)
+        return iriCache[iri]
+
     # Check if defined in TTL file
-    if (URIRef(iri), None, URIRef('http://www.w3.org/2002/07/owl#NamedIndividual')) in g:
-        if (URIRef(iri), URIRef('http://www.w3.org/2000/01/rdf-schema#label'), None) in g:
+    node = URIRef(iri)
+    if (node, None, NAMED_INDIVIDUAL) in g:
+        if (node, RDFS_LABEL, None) in g:
 
             # URIRef is defined elsewhere in the TTL File
 
             # URI is an RRID --> Should be defined in TTL
             if iri.startswith('https://scicrunch.org/resolver/RRID:'):
-                out = g.objects(subject= URIRef(iri), predicate=URIRef('http://www.w3.org/2000/01/rdf-schema#label'))
+                out = g.objects(subject=node, predicate=RDFS_LABEL)
                 for v in out:
                     result_dict = {'iri': iri,
                         'labels': [v],
@@ -211,20 +233,27 @@ def iri_lookup(g, iri, iriCache=None):
             elif iri.startswith('http://purl.obolibrary.org/obo/UBERON_'):
                 url = 'https://scicrunch.org/api/1/sparc-scigraph/vocabulary/id/{}?key={}'.format(
                     quote_plus(iri), apiKey)
-                r = requests.get(url)
-                if r.status_code == 200:
-                    log.debug('SciCrunch lookup successful: %s', iri)
-                    iriCache[iri] = r.json()
-                    return r.json()
-                else:
-                    log.error('SciCrunch HTTP Error: %d %s iri= %s', r.status_code, r.reason, iri)
+                try:
+                    r = requests.get(url)
+                    if r.status_code == 200:
+                        log.debug('SciCrunch lookup successful: %s', iri)
+                        iriCache[iri] = r.json()
+                        return iriCache[iri]
+                except (requests.RequestException, ValueError) as e:
+                    # Don't cache failed requests, the next dataset may resolve the term
+                    log.error('SciCrunch request failed: %s iri= %s', e, iri)
+                    return None
+
+                log.error('SciCrunch HTTP Error: %d %s iri= %s', r.status_code, r.reason, iri)
+                if r.status_code != 404:
+                    # Only cache terms that SciCrunch does not know about
+                    return None
 
 
     if any(iri.startswith(s) for s in skipIri):
-        return strip_iri(iri.strip())
-    if iri in iriCache:
-        log.debug('Returning cached IRI: %s', iri)
+        iriCache[iri] = strip_iri(iri.strip())
         return iriCache[iri]
+
     # if 'ror.org' in iri:
     #     # Use ROR API
     #     url = 'https://api.ror.org/organizations/{}'.format(quote_plus(iri))
@@ -246,19 +275,15 @@ def iri_lookup(g, iri, iriCache=None):
     #     return r.json()
     # log.error('SciCrunch HTTP Error: %d %s iri= %s', r.status_code, r.reason, iri)
 
+    # Remember unresolved IRIs too, so they are not looked up again
+    iriCache[iri] = None
+
 def get_first(node, name, default=None):
     try:
         return node[name][0]
     except (KeyError, IndexError):
         return default
 
-### Helper function to check li
-def contains(list, filter):
-    for x in list:
-        if filter(x):
-            return x
-    return False
-
 def is_number(string):
     try:
         float(string)
@@ -267,19 +292,36 @@ def is_number(string):
         return False
 
 ### Parsing JSON data:
+def load_json(file_name):
+    '''Load a JSON file, using orjson when available'''
+    with open(file_name, 'rb') as f:
+        log.info("Loaded '%s'", file_name)
+        if orjson is not None:
+            return orjson.loads(f.read())
+        return json.load(f)
+
 def get_json():
     '''Load JSON files containing expired and new metadata'''
-    with open(JSON_METADATA_FULL, 'r') as f:
-        log.info("Loaded '{}'".format(JSON_METADATA_FULL))
-        data = json.load(f)
-    return data
+    return load_json(JSON_METADATA_FULL)
+
+def iter_json():
+    '''Yield (dataset id, metadata) pairs from the metadata file one at a time
+
+    With ijson installed the file is streamed, so only the datasets currently
+    being processed are held in memory.
+    '''
+    if ijson is None:
+        yield from get_json().items()
+        return
+
+    with open(JSON_METADATA_FULL, 'rb') as f:
+        log.info("Streaming '%s'", JSON_METADATA_FULL)
+        yield from ijson.kvitems(f, '', use_float=True)
 
 def get_resume_list(file_name):
     '''Load JSON files containing resume info'''
-    with open(file_name, 'r') as f:
-        log.info("Loaded '{}'".format(file_name))
-        data = json.load(f)
-        print(data)
+    data = load_json(file_name)
+    log.info('Resuming after datasets: %s', data)
     return data
 
 def get_bf_model(ds, name):
@@ -288,35 +330,74 @@ def get_bf_model(ds, name):
         This method return the Blackfynn Model with a particular
         name for a particular dataset. The method provides a cache
         to prevent an API call when the model has previously been 
-        loaded
+        loaded. The cache is kept per dataset so datasets can be
+        updated concurrently.
     """
 
     if not hasattr(get_bf_model, "models"):
         log.debug('SETUP MODEL CACHE')
+        get_bf_model.models = {}
+
+    ds_models = get_bf_model.models.setdefault(ds.id, {})
+    if name in ds_models:
+        log.debug('RETURN MODEL FROM CACHE')
+        return ds_models[name]
+
+    log.debug('ADDING MODEL TO CACHE')
+    try:
+        # Get model from platform and add to cache
         model = ds.get_model(name)
-        get_bf_model.models = {name: model}
-        get_bf_model.model_ds = ds.id
-        return model
-    elif get_bf_model.model_ds != ds.id:
-        log.debug('SWITCHING DS')
-        model = ds.get_model(name)
-        get_bf_model.models = {name: model}
-        get_bf_model.model_ds = ds.id
-        return model
+    except:
+        # Model does not exist on the platform
+        return None
+
+    ds_models[name] = model
+    return model
+
+def set_bf_model(ds, name, model):
+    """Store model in the get_bf_model cache, or remove it when model is None"""
+
+    if not hasattr(get_bf_model, "models"):
+        get_bf_model.models = {}
+
+    ds_models = get_bf_model.models.setdefault(ds.id, {})
+    if model is None:
+        ds_models.pop(name, None)
+        # Relationship types are pinned to model ids, which change when a model is recreated
+        if hasattr(get_bf_relationship, "relationships"):
+            get_bf_relationship.relationships.pop(ds.id, None)
     else:
-        if name in get_bf_model.models:
-            log.debug('RETURN MODEL FROM CACHE')
-            return get_bf_model.models[name]
-        else:
-            log.debug('ADDING MODEL TO CACHE')
-            try:
-                # Get model from platform and add to cache
-                model = ds.get_model(name)
-                get_bf_model.models.update({name: model})
-                return model
-            except:
-                # Model does not exist on the platform
-                return None
+        ds_models[name] = model
+
+def get_bf_relationship(ds, name, source, destination):
+    """Return the relationship type with name in dataset
+
+        Relating records by relationship name makes the platform client
+        fetch all relationship types of the dataset on every call. This
+        method fetches them once per dataset, creates the relationship
+        type between the source and destination models if it does not
+        exist yet, and caches the result per source and destination model.
+    """
+
+    if not hasattr(get_bf_relationship, "relationships"):
+        get_bf_relationship.relationships = {}
+
+    ds_relationships = get_bf_relationship.relationships.get(ds.id)
+    if ds_relationships is None:
+        ds_relationships = {'remote': ds.relationships(), 'types': {}}
+        get_bf_relationship.relationships[ds.id] = ds_relationships
+
+    key = (name, source.type, destination.type)
+    if key not in ds_relationships['types']:
+        relationship = ds_relationships['remote'].get(name)
+        if relationship is None or relationship.source != source.id or \
+                relationship.destination != destination.id:
+            log.debug('CREATING RELATIONSHIP TYPE: %s', key)
+            relationship = ds.create_relationship_type(
+                name, name, source=source.id, destination=destination.id)
+        ds_relationships['types'][key] = relationship
+
+    return ds_relationships['types'][key]
 
 def get_record_by_id(json_id, model, record_cache):
     """Get Blackfynn Record by its JSON ID
@@ -1,7 +1,7 @@
 from pennsieve import ModelProperty
 from pennsieve.base import UnauthorizedException
-from base import MODEL_NAMES, SPARC_DATASET_ID
-from requests.exceptions import HTTPError
+from base import MODEL_NAMES, SPARC_DATASET_ID, get_bf_model, set_bf_model
+from requests.adapters import HTTPAdapter
 import logging
 import math
 from datetime import datetime as DT
@@ -24,13 +24,21 @@ def authorized(bf, dsId):
         return False
     return str(role)
 
+def set_connection_pool_size(bf, size):
+    '''Let the client keep `size` connections alive, so concurrent requests reuse them'''
+    session = bf._api.session
+    retries = session.get_adapter('https://').max_retries
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
 def get_create_hash_ds(bf):
     """ Create or get dataset used to track updates
     """
     try:
         ds = bf.get_dataset('sparc_curation_sync')
     except:
-        log.warning('Failed to get dataset --> Creating dataset: {}"'.format('sparc_curation_sync'))
+        log.warning('Failed to get dataset --> Creating dataset: %s', 'sparc_curation_sync')
         ds = bf.create_dataset('sparc_curation_sync')
 
     # Clear dataset model in case the structure has changed
@@ -53,7 +61,7 @@ def get_create_hash_ds(bf):
     return ds
 
 def add_file_to_record(bf, ds, record_id, file_id):
-    log.info("Linking file_id: {} to record_id: {}".format(file_id, record_id))
+    log.info("Linking file_id: %s to record_id: %s", file_id, record_id)
     host = "{}/".format(bf._api.settings.api_host)
 
     payload = {
@@ -134,9 +142,9 @@ def search_for_records(bf, ds, model_name, filters):
         
         rec = records[0]
 
-        log.info("Found Record: {}-{}".format(model_name, rec['id']))
+        log.info("Found Record: %s-%s", model_name, rec['id'])
     else:
-        log.info("COULD NOT FIND RECORD: {}".format(filters))
+        log.info("COULD NOT FIND RECORD: %s", filters)
 
     return rec
 
@@ -175,11 +183,23 @@ def get_create_dataset(bf, dsId):
     try:
         ds = bf.get_dataset(dsId)
     except:
-        log.warning('Failed to get dataset --> Creating dataset: {}"'.format(dsId))
+        log.warning('Failed to get dataset --> Creating dataset: %s', dsId)
         ds = bf.create_dataset(dsId)
 
     return ds
 
+def delete_all_records(model, n=500):
+    '''Delete all records of a model one page at a time
+
+    Deleted records drop out of the next page, so the offset stays at 0. The
+    number of pages is bounded by the model count in case some deletes fail.
+    '''
+    for _ in range(math.ceil(model.count / n)):
+        recs = model.get_all(limit = n)
+        if not recs:
+            break
+        model.delete_records(*recs)
+
 def clear_dataset(bf, dataset):
     '''
     DANGER! Deletes all records of type:
@@ -196,36 +216,28 @@ def clear_dataset(bf, dataset):
 
     '''
 
-    models = dataset.models().values()
+    all_models = dataset.models()
+    models = [all_models[name] for name in MODEL_NAMES if name in all_models]
     log.info(models)
     for m in models:
-        if m.type not in MODEL_NAMES:
-            continue
-        elif m.count > 0:
-            recs = m.get_all(limit = m.count)
-            m.delete_records(*recs)
+        if m.count > 0:
+            delete_all_records(m)
         m.delete()
+        set_bf_model(dataset, m.type, None)
             
-    log.info("Cleared dataset '{}'".format(dataset.name))
+    log.info("Cleared dataset '%s'", dataset.name)
 
 def clear_model(bf, ds, model_name):
     try:
         model = ds.get_model(model_name)
     except:
-        print('Model {} does not exist in {}'.format(model_name, ds))
+        log.info('Model %s does not exist in %s', model_name, ds)
         return
 
-    n = 100
-    nr_batches = math.floor(model.count/n )
-    if nr_batches > 1:
-        for i in range(0, nr_batches):
-            recs = model.get_all(limit = n)
-            model.delete_records(*recs)
-
-    recs = model.get_all(limit = n)
-    model.delete_records(*recs)
+    delete_all_records(model)
 
     model.delete()
+    set_bf_model(ds, model_name, None)
     
 def get_create_model(bf, ds, name, displayName, schema=None, linked=None):
     '''create a model if it doesn't exist,
@@ -235,22 +247,22 @@ def get_create_model(bf, ds, name, displayName, schema=None, linked=None):
     if linked is None:
         linked = []
 
-    # Try to get model or create model if not exist.
-    try:
-        model = ds.get_model(name)
-        #TODO: Validate if schema matches
-        # if schema:
-        #     raise(Exception("Trying to update schema of existing model"))
-    except HTTPError:
+    # Try to get model (cached per dataset) or create model if not exist.
+    model = get_bf_model(ds, name)
+    #TODO: Validate if schema matches
+    # if schema:
+    #     raise(Exception("Trying to update schema of existing model"))
+    if model is None:
         if schema:
             model = ds.create_model(name, displayName, schema=schema)
+            set_bf_model(ds, name, model)
         else:
             raise(Exception("Unsuccessful in creating new model --> no schema"))
 
     # Check if links contain linked properties that don't exist and add if the case.
     new_links = [l for l in linked if l.name not in model.linked]
     if new_links:
-        log.info("Has new Property Links for: {}".format(name))
+        log.info("Has new Property Links for: %s", name)
         model.add_linked_properties(new_links)
 
     return model
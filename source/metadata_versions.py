@@ -1,6 +1,8 @@
 'Download the two latest SPARC TTLs'
 from shutil import copyfileobj
+import json
 import logging
+import os
 
 from bs4 import BeautifulSoup
 import requests
@@ -18,6 +20,7 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 BASE_URL = 'https://cassava.ucsd.edu/sparc/exports/'
+VALIDATORS_SUFFIX = '.validators.json'
 
 def getVersion(offset_from_latest):
     r = requests.get(BASE_URL)
@@ -31,14 +34,46 @@ def latest_version():
     hrefs = (x.get('href') for x in soup.find_all(href=lambda x: x and not x.startswith('.')))  
     return unquote(max(hrefs)).strip('/')
 
+def getValidators(filename):
+    '''Return the conditional request headers saved with a previous download of `filename`'''
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename + VALIDATORS_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveValidators(filename, headers):
+    '''Store the ETag/Last-Modified of a download so the next run can skip unchanged files'''
+    validators = {}
+    if 'ETag' in headers:
+        validators['If-None-Match'] = headers['ETag']
+    if 'Last-Modified' in headers:
+        validators['If-Modified-Since'] = headers['Last-Modified']
+    with open(filename + VALIDATORS_SUFFIX, 'w') as f:
+        json.dump(validators, f)
+
 def getTTL(version, filename):
-    '''Get a version of the sparc metadata file, save it to `filename`'''
+    '''Get a version of the sparc metadata file, save it to `filename`
+
+    The download is skipped if the server reports the file has not changed
+    since it was last saved to `filename`.
+    '''
     url = BASE_URL + 'curation-export.ttl'
     log.info(url)
-    with requests.get(url, stream=True) as r:
+    with requests.get(url, stream=True, headers=getValidators(filename)) as r:
+        if r.status_code == 304:
+            log.info("'%s' is up to date, skipping download", filename)
+            return
         r.raise_for_status()
+
+        # Drop the old validators first so an interrupted download is not reused
+        if os.path.exists(filename + VALIDATORS_SUFFIX):
+            os.remove(filename + VALIDATORS_SUFFIX)
         with open(filename, 'wb') as f:
             copyfileobj(r.raw, f)
+        saveValidators(filename, r.headers)
 
 def getSpecificTTLVersion(version):
     file_name = "{}_{}.ttl".format(TTL_FILE_NEW[:-4], version)
@@ -4,10 +4,25 @@ import logging
 import re
 import sys
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from functools import lru_cache
 
 from rdflib import BNode, Graph, URIRef, term
 from rdflib.namespace import RDF, RDFS, SKOS, OWL
-from rdflib.compare import graph_diff
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Optional rdflib plugin with a compiled Turtle parser and triple store.
+    # It needs rdflib 6 or later, so it is not available with the pinned rdflib.
+    import oxrdflib
+except ImportError:
+    oxrdflib = None
 
 from base import (
     JSON_METADATA_FULL,
@@ -20,8 +35,20 @@ from base import (
     get_recordset_hash
 )
 
+from metadata_versions import getValidators
+
 log = logging.getLogger(__name__)
 
+# Set USE_OXIGRAPH=false to parse with the pure-Python rdflib parser
+USE_OXIGRAPH = oxrdflib is not None and \
+    os.environ.get('USE_OXIGRAPH', 'true').strip().lower() not in ('0', 'false', 'no')
+
+# Suffix of the file recording which TTL file and parser a JSON file was built from
+SOURCE_SUFFIX = '.source.json'
+
+# Modules whose changes alter the JSON output (strip_iri, iri_lookup and arrayProps live in base)
+SOURCE_MODULES = (__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'base.py'))
+
 # Create a new file-logger for this dataset
 log_file_name = "/tmp/sparc-ttl-json.log"
 
@@ -37,9 +64,42 @@ for hdlr in log.handlers[:]:  # remove the existing file handlers
 filehandler.setLevel(logging.INFO)
 log.addHandler(filehandler)
 
+#%% [markdown]
+### Constants
+#%%
+## Skipping following IRI's as they are handled separately (getResearcher, getProtocols, etc.)
+SKIP_PREDICATES = frozenset([
+    URIRef('http://uri.interlex.org/temp/uris/contributorTo'),
+    URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#type'),
+    URIRef('http://uri.interlex.org/temp/uris/hasUriApi'),
+    # URIRef('http://uri.interlex.org/temp/uris/hasUriHuman'),
+    URIRef('http://uri.interlex.org/temp/uris/hasProtocol'),
+    URIRef('http://uri.interlex.org/temp/uris/wasUpdatedAtTime')])
+
+MEASUREMENT = URIRef('http://uri.interlex.org/tgbugs/uris/readable/sparc/Measurement')
+HAS_UNIT = URIRef('http://uri.interlex.org/temp/uris/hasUnit')
+RDF_VALUE = URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#value')
+RDF_FIRST = URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#first')
+RDF_REST = URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#rest')
+RDFS_DATATYPE = URIRef('http://www.w3.org/2000/01/rdf-schema#Datatype')
+OWL_ON_DATATYPE = URIRef('http://www.w3.org/2002/07/owl#onDatatype')
+OWL_WITH_RESTRICTIONS = URIRef('http://www.w3.org/2002/07/owl#withRestrictions')
+XSD_MIN_INCLUSIVE = URIRef('http://www.w3.org/2001/XMLSchema#minInclusive')
+XSD_MAX_INCLUSIVE = URIRef('http://www.w3.org/2001/XMLSchema#maxInclusive')
+
+## Patterns for extracting dataset, subject and sample ids from IRIs
+DATASET_RE = re.compile(r"N:dataset:[:\w-]+")
+SUBJECT_RE = re.compile(r"(?P<ds>N:dataset:[:\w-]+)/subjects/(?P<sub>[\w%-]+)")
+SAMPLE_RE = re.compile(r"(?P<ds>N:dataset:[:\w-]+)/samples/(?P<sub>.*$)")
+
 #%% [markdown]
 ### Helper functions
 #%%
+@lru_cache(maxsize=4096)
+def predicateKey(p):
+    "Return the output key for predicate p (predicates repeat across triples)"
+    return sys.intern(strip_iri(p.strip()))
+
 def addEntry(output, datasetId):
     "Add a value for output[datasetId] if it doesn't already exist"
     output.setdefault(datasetId,
@@ -47,46 +107,46 @@ def addEntry(output, datasetId):
 
 def parseMeasure(dsId, g, node, values):
 
-    if (node, None, URIRef('http://uri.interlex.org/tgbugs/uris/readable/sparc/Measurement')) in g:
+    if (node, None, MEASUREMENT) in g:
         # Current BNode is a measurement
         # preds = g.predicates(subject=node)
         # for v in preds:
         #     print('pred: {}'.format(v))
         #     values['unit'] = strip_iri(v)
         
-        unit = strip_iri(g.value(subject=node, predicate=URIRef('http://uri.interlex.org/temp/uris/hasUnit')))
+        unit = strip_iri(g.value(subject=node, predicate=HAS_UNIT))
         values['unit'] = unit
             
-        value = g.value(subject=node, predicate=URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#value'))
+        value = g.value(subject=node, predicate=RDF_VALUE)
         values['value'] = str(value)
 
         if values['unit'] == 'dimensionless':
-            log.warning("Measurement with no unit (value: {}) in {}".format(values['value'], dsId))
+            log.warning("Measurement with no unit (value: %s) in %s", values['value'], dsId)
 
-    elif (node, None, URIRef('http://www.w3.org/2000/01/rdf-schema#Datatype')) in g:
+    elif (node, None, RDFS_DATATYPE) in g:
             # Current BNode is a rdfs:Datatype
 
-            unit = strip_iri(g.value(subject=node, predicate=URIRef('http://www.w3.org/2002/07/owl#onDatatype')))
+            unit = strip_iri(g.value(subject=node, predicate=OWL_ON_DATATYPE))
             values['unit'] = strip_iri(unit)
 
-            value = g.value(subject=node, predicate=URIRef('http://www.w3.org/2002/07/owl#withRestrictions'))
+            value = g.value(subject=node, predicate=OWL_WITH_RESTRICTIONS)
             
             # Get Lower Bound Range
-            first = g.value(subject=value, predicate=URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#first'))
-            min_incl = g.value(subject=first, predicate=URIRef('http://www.w3.org/2001/XMLSchema#minInclusive'))
+            first = g.value(subject=value, predicate=RDF_FIRST)
+            min_incl = g.value(subject=first, predicate=XSD_MIN_INCLUSIVE)
             
             #Get Higher Bound Range
-            rest = g.value(subject=value, predicate=URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#rest'))
-            rest_first = g.value(subject=rest, predicate=URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#first'))
-            max_incl = g.value(subject=rest_first, predicate=URIRef('http://www.w3.org/2001/XMLSchema#maxInclusive'))
+            rest = g.value(subject=value, predicate=RDF_REST)
+            rest_first = g.value(subject=rest, predicate=RDF_FIRST)
+            max_incl = g.value(subject=rest_first, predicate=XSD_MAX_INCLUSIVE)
 
             values['value'] = "{}-{}".format(str(min_incl), str(max_incl))
 
             if values['unit'] == 'dimensionless':
-                log.warning("Measurement with no unit (value: {}) in {}".format(values['value'], dsId))
+                log.warning("Measurement with no unit (value: %s) in %s", values['value'], dsId)
 
     else:
-        log.warning("Encountered a B-Node that is not a measurement in {}".format(dsId))
+        log.warning("Encountered a B-Node that is not a measurement in %s", dsId)
 
     return values
 
@@ -104,21 +164,16 @@ def parseMeasure(dsId, g, node, values):
 
 #%%
 def populateValue(g, datasetId, ds, data, p, o, iriCache):
+    "Add the value of (p, o) to data, which must be a defaultdict(list)"
 
-    ## Skipping following IRI's as they are handled separately (getResearcher, getProtocols, etc.)
-    skipIri = [
-        term.URIRef('http://uri.interlex.org/temp/uris/contributorTo'),
-        term.URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#type'),
-        term.URIRef('http://uri.interlex.org/temp/uris/hasUriApi'),
-        # term.URIRef('http://uri.interlex.org/temp/uris/hasUriHuman'),
-        term.URIRef('http://uri.interlex.org/temp/uris/hasProtocol'),
-        term.URIRef('http://uri.interlex.org/temp/uris/wasUpdatedAtTime')]
-    key = strip_iri(p.strip())
-
-    if p in skipIri:
+    if p in SKIP_PREDICATES:
         return
 
-    if isinstance(o, term.URIRef):
+    key = predicateKey(p)
+
+    # Terms produced by the parsers are never subclassed, so compare types directly
+    oType = type(o)
+    if oType is URIRef:
         value = iri_lookup(g, o.strip(), iriCache)
         if value:
             if isinstance(value, dict) and 'curie' in value:
@@ -130,8 +185,7 @@ def populateValue(g, datasetId, ds, data, p, o, iriCache):
             #     value = key
 
             if key in arrayProps:
-                array = data.setdefault(key, [])
-                array.append(value)
+                data[key].append(value)
             
             else:
                 if key in data:
@@ -145,11 +199,10 @@ def populateValue(g, datasetId, ds, data, p, o, iriCache):
                 else:
                     data[key] = value
 
-    elif isinstance(o, term.Literal):
+    elif oType is term.Literal:
         value = strip_iri(o.strip())
         if key in arrayProps:
-            array = data.setdefault(key, [])
-            array.append(value)
+            data[key].append(value)
         else:
             if key in data:
                 log.warning('Unexpected creation of array for:  %s - %s - %s', datasetId, key, value)
@@ -162,7 +215,7 @@ def populateValue(g, datasetId, ds, data, p, o, iriCache):
             else:
                 data[key] = value
 
-    elif isinstance(o, term.BNode):
+    elif oType is BNode:
         data[key] = parseMeasure(datasetId, g, o, {'value': '', 'unit': ''})
 
     else:
@@ -171,15 +224,15 @@ def populateValue(g, datasetId, ds, data, p, o, iriCache):
 def getDatasets(gNew, gDelta, output, iriCache):
     # Iterate over Datasets
     for ds in gNew.subjects(RDF.type, URIRef('http://uri.interlex.org/tgbugs/uris/readable/sparc/Resource')):
-        m = re.search(r".*(?P<ds>N:dataset:[:\w-]+)", ds)
-
-        datasetId = strip_iri(m.group('ds').strip())
+        datasetId = sys.intern(DATASET_RE.search(ds).group(0))
         addEntry(output, datasetId)
         log.info("Adding dataset: " + datasetId)
+        summary = defaultdict(list, output[datasetId]['summary'])
         for p, o in gDelta.predicate_objects(ds):
             if p == URIRef("http://uri.interlex.org/temp/uris/hasAwardNumber"):
                 getAwards(o, datasetId, output)
-            populateValue(gDelta, datasetId, output[datasetId], output[datasetId]['summary'], p, o, iriCache)
+            populateValue(gDelta, datasetId, output[datasetId], summary, p, o, iriCache)
+        output[datasetId]['summary'] = dict(summary)
 
 # def getContributors(gNew, gDelta, output, iriCache):
 #     # Iterate over Researchers
@@ -199,53 +252,50 @@ def getDatasets(gNew, gDelta, output, iriCache):
 def getResearchers(gNew, gDelta, output, iriCache):
     # Iterate over Researchers
     for s, o in gNew.subject_objects(URIRef('http://uri.interlex.org/temp/uris/contributorTo')):
-        m = re.search(r".*(?P<ds>N:dataset:[:\w-]+)", o)
-        datasetId = strip_iri(m.group('ds').strip())
+        datasetId = sys.intern(DATASET_RE.search(o).group(0))
         user = strip_iri(s)
         # user = s #s.split('/')[-1] # either a blackfynn user id or "Firstname-Lastname"
-        newEntry = {}
+        newEntry = defaultdict(list)
 
         for p2, o2 in gDelta.predicate_objects(s):
             populateValue(gDelta, datasetId, output[datasetId], newEntry, p2, o2, iriCache)
         if newEntry:
-            output[datasetId]['researcher'][user] = newEntry
+            output[datasetId]['researcher'][user] = dict(newEntry)
 
 def getSubjects(gNew, gDelta, output, iriCache):
     # Iterate over Subjects
     for s in gNew.subjects(RDF.type, URIRef('http://uri.interlex.org/tgbugs/uris/readable/sparc/Subject')):
-        m = re.search(r".*(?P<ds>N:dataset:[:\w-]+)/subjects/(?P<sub>[\w%-]+)", s)
-        datasetId = m.group('ds').strip()
-        subj_id = m.group('sub').strip()
-        output[datasetId]['subject'][subj_id] = {}
+        m = SUBJECT_RE.search(s)
+        datasetId = sys.intern(m.group('ds'))
+        subj_id = m.group('sub')
+        newEntry = defaultdict(list)
         for p2, o2 in gDelta.predicate_objects(s):
-            populateValue(gDelta, datasetId, output[datasetId],output[datasetId]['subject'][subj_id], p2, o2, iriCache)
+            populateValue(gDelta, datasetId, output[datasetId], newEntry, p2, o2, iriCache)
+        output[datasetId]['subject'][subj_id] = dict(newEntry)
 
 def getSamples(gNew, gDelta, output, iriCache):
     # Iterate over Samples
     for s in gNew.subjects(RDF.type, URIRef('http://uri.interlex.org/tgbugs/uris/readable/sparc/Sample')):
-
-
-        m = re.search(r".*(?P<ds>N:dataset:[:\w-]+)/samples/(?P<sub>.*$)", s)
-        datasetId = m.group('ds').strip()
+        m = SAMPLE_RE.search(s)
+        datasetId = sys.intern(m.group('ds'))
         sampleId = m.group('sub').strip()
-        newEntry = {}
+        newEntry = defaultdict(list)
         for p2, o2 in gDelta.predicate_objects(s):
             populateValue(gDelta, datasetId, output[datasetId], newEntry, p2, o2, iriCache)
         if newEntry:
-            print("adding sample")
-            output[datasetId]['sample'][sampleId] = newEntry
+            log.debug("adding sample")
+            output[datasetId]['sample'][sampleId] = dict(newEntry)
 
 def getProtocols(gNew, gDelta, output, iriCache):
     # Iterate over Protocols
     for s, o in gNew.subject_objects(URIRef('http://uri.interlex.org/temp/uris/hasProtocol')):
-        m = re.search(r".*(?P<ds>N:dataset:[:\w-]+)", s)
-        datasetId = strip_iri(m.group('ds').strip())
+        datasetId = sys.intern(DATASET_RE.search(s).group(0))
         url = str(o)
-        newEntry = {}
+        newEntry = defaultdict(list)
         for p2, o2 in gDelta.predicate_objects(o):
             populateValue(gDelta, datasetId, output[datasetId], newEntry, p2, o2, iriCache)
         if newEntry:
-            output[datasetId]['protocol'][url] = newEntry
+            output[datasetId]['protocol'][url] = dict(newEntry)
 
 def getAwards(awardIdURI, dsId, output):
     # Iterate over awards
@@ -255,11 +305,14 @@ def getAwards(awardIdURI, dsId, output):
     }
 
 def getTags(gNew, gDelta, output, iriCache):
+    # Collect unique tags per dataset, preserving order of first occurrence
+    tags = {}
+
     # Iterate over Protocols
     for s, o in gNew.subject_objects(URIRef('http://purl.obolibrary.org/obo/IAO_0000136')):
-        m = re.search(r".*(?P<ds>N:dataset:[:\w-]+)", s)
+        m = DATASET_RE.search(s)
         if m:
-            if isinstance(o, term.URIRef):
+            if type(o) is URIRef:
                 t = iri_lookup(gNew, o, iriCache)
                 if t:
                     if isinstance(t, str):
@@ -271,9 +324,11 @@ def getTags(gNew, gDelta, output, iriCache):
             else:
                 tag = str(o)
 
-            datasetId = strip_iri(m.group('ds').strip())
-            if tag not in output[datasetId]['tag']:
-                output[datasetId]['tag'].append(tag)
+            datasetId = sys.intern(m.group(0))
+            tags.setdefault(datasetId, {})[tag] = None
+
+    for datasetId, ds_tags in tags.items():
+        output[datasetId]['tag'].extend(ds_tags)
 
 def sort_output(input):
     """ Recursively sort all arrays in input
@@ -294,7 +349,80 @@ def compute_hash_for_records(input):
                 for key, value in dataset[model].items():
                     dataset[model][key]['hash'] = get_recordset_hash(value)
 
-def buildJson(version):
+#%% [markdown]
+### Parallel passes
+#%%
+## Passes run after getDatasets, each one fills a single section of every dataset
+PASSES = (
+    ('tag', getTags),
+    ('researcher', getResearchers),
+    ('subject', getSubjects),
+    ('sample', getSamples),
+    ('protocol', getProtocols))
+
+## Graph shared with forked workers, so it does not have to be pickled per pass
+passGraph = None
+passIriCache = None
+
+def runPass(section, fnc, datasetIds):
+    "Run a get* pass in a worker and return the section and terms for each dataset"
+    output = {}
+    for datasetId in datasetIds:
+        addEntry(output, datasetId)
+    fnc(passGraph, passGraph, output, passIriCache)
+    return {dsId: (entry[section], entry['term']) for dsId, entry in output.items()}
+
+def runPasses(g, output, workers, iriCache):
+    "Run all PASSES concurrently in forked processes and merge them into output"
+    # Forked workers inherit the graph and the IRI lookups made so far
+    global passGraph, passIriCache
+    passGraph = g
+    passIriCache = iriCache
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+            futures = [(section, executor.submit(runPass, section, fnc, list(output)))
+                for section, fnc in PASSES]
+            for section, future in futures:
+                log.info('Merging %s...', section)
+                for datasetId, (values, terms) in future.result().items():
+                    output[datasetId][section] = values
+                    output[datasetId]['term'].update(terms)
+    finally:
+        passGraph = None
+        passIriCache = None
+
+def parseTTL(file_name):
+    "Parse a TTL file, using the oxigraph store and parser when available"
+    if USE_OXIGRAPH:
+        log.info("Parsing '%s' with oxigraph", file_name)
+        return Graph(store='Oxigraph').parse(file_name, format='ox-turtle')
+
+    return Graph().parse(file_name, format='turtle')
+
+def buildSource(input_file):
+    "Describe the TTL file, parser and code that a JSON file is built from"
+    stat = os.stat(input_file)
+    return {
+        'input': os.path.abspath(input_file),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'etag': getValidators(input_file).get('If-None-Match'),
+        'parser': 'ox-turtle' if USE_OXIGRAPH else 'turtle',
+        'code': [os.stat(f).st_mtime_ns for f in SOURCE_MODULES]
+    }
+
+def getBuildSource(output_file):
+    "Return the build source recorded after the last successful write of `output_file`"
+    if not os.path.exists(output_file):
+        return None
+    try:
+        with open(output_file + SOURCE_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def buildJson(version, workers=1, force=False):
     log.info('Building new meta data json')
 
     output_file = JSON_METADATA_FULL
@@ -303,7 +431,13 @@ def buildJson(version):
         output_file = "{}_{}.json".format(output_file[:-5], version)
         input_file = "{}_{}.ttl".format(input_file[:-4], version)
 
-    gNew = Graph().parse(input_file, format='turtle')
+    # Skip the parse when the JSON was already built from this TTL file
+    source = buildSource(input_file)
+    if not force and getBuildSource(output_file) == source:
+        log.info("'%s' is up to date with '%s', skipping", output_file, input_file)
+        return
+
+    gNew = parseTTL(input_file)
 
     output = {}
     iriCache = {}
@@ -312,25 +446,29 @@ def buildJson(version):
     getDatasets(gNew, gNew, output, iriCache)
 
     log.info("The properties below are expected to be of type array.")
-    log.info(arrayProps)
+    log.info(sorted(arrayProps))
 
     # log.info('Getting Contributors...')
     # getContributors(gNew, gDelta, output, iriCache)
 
-    log.info('Getting tags...')
-    getTags(gNew, gNew, output, iriCache)
+    if workers > 1:
+        log.info('Getting tags, researchers, subjects, samples and protocols with %d workers...', workers)
+        runPasses(gNew, output, workers, iriCache)
+    else:
+        log.info('Getting tags...')
+        getTags(gNew, gNew, output, iriCache)
 
-    log.info('Getting Researchers...')
-    getResearchers(gNew, gNew, output, iriCache)
+        log.info('Getting Researchers...')
+        getResearchers(gNew, gNew, output, iriCache)
 
-    log.info('Getting Subjects...')
-    getSubjects(gNew, gNew, output, iriCache)
+        log.info('Getting Subjects...')
+        getSubjects(gNew, gNew, output, iriCache)
 
-    log.info('Getting Samples...')
-    getSamples(gNew, gNew, output, iriCache)
+        log.info('Getting Samples...')
+        getSamples(gNew, gNew, output, iriCache)
 
-    log.info('Getting Protocols...')
-    getProtocols(gNew, gNew, output, iriCache)
+        log.info('Getting Protocols...')
+        getProtocols(gNew, gNew, output, iriCache)
     del iriCache
 
     # Sort all arrays
@@ -341,6 +479,20 @@ def buildJson(version):
     log.info("Compute hash for all records")
     compute_hash_for_records(output)
 
-    with open(output_file, 'w') as f:
-        json.dump(output, f, sort_keys=True)
-        log.info("Added %d datasets to '%s'", len(output), f.name)
+    # Drop the old marker first so an interrupted write is never treated as current
+    if os.path.exists(output_file + SOURCE_SUFFIX):
+        os.remove(output_file + SOURCE_SUFFIX)
+
+    # Write to a temporary file and swap it in, so readers never see a partial JSON file
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        if orjson is not None:
+            # Keys from strip_iri can be rdflib URIRef/Literal, which orjson only accepts with OPT_NON_STR_KEYS
+            f.write(orjson.dumps(output, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS))
+        else:
+            f.write(json.dumps(output, sort_keys=True).encode('utf-8'))
+    os.replace(tmp_file, output_file)
+    log.info("Added %d datasets to '%s'", len(output), output_file)
+
+    with open(output_file + SOURCE_SUFFIX, 'w') as f:
+        json.dump(source, f)
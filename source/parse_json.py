@@ -6,7 +6,11 @@ import re
 import sys
 import os
 import requests
-import math
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import shelve
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from pennsieve.models import ModelPropertyEnumType, BaseCollection, ModelPropertyType
 from pennsieve import Pennsieve, ModelProperty, LinkedModelProperty
 
@@ -23,17 +27,23 @@ from bf_io import (
     search_for_records,
     create_links,
     create_reference,
-    add_file_to_record
+    add_file_to_record,
+    set_connection_pool_size
 )
 
 from base import (
+    AWARD_CACHE_FILE,
+    AWARD_CACHE_TTL,
+    AWARD_CACHE_MISS_TTL,
+    AWARD_CACHE_ERROR_TTL,
     JSON_METADATA_FULL,
     JSON_METADATA_NEW,
     SPARC_DATASET_ID,
     MODEL_NAMES,
-    get_json,
+    iter_json,
     get_first,
     get_bf_model,
+    get_bf_relationship,
     get_as_list,
     parse_unit_value,
     has_bf_access,
@@ -51,29 +61,213 @@ logging.basicConfig(format="%(asctime);s%(filename)s:%(lineno)d:\t%(message)s")
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Shared HTTP session to reuse connections for award lookups
+FEDERAL_REPORTER_URL = 'https://api.federalreporter.nih.gov/v1/projects/search'
+reporter_session = requests.Session()
+reporter_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])))
+award_cache_lock = threading.Lock()
+AWARD_LOOKUP_WORKERS = 8
+
+# Subject id at the end of a sample's wasDerivedFromSubject IRI
+SUBJECT_IRI_RE = re.compile(r'.*/subjects/(.+)')
+
+### MODEL SCHEMAS
+# Static model schemas are built once at import instead of on every model lookup.
+
+PROTOCOL_SCHEMA = [
+    ModelProperty('label', 'Name', title=True),
+    ModelProperty('url', 'URL',data_type=ModelPropertyType(
+            data_type=str, format='url')),
+    ModelProperty('publisher', 'publisher'),
+    ModelProperty('date', 'Date', data_type=ModelPropertyType(
+            data_type='date' )),
+    ModelProperty('protocolHasNumberOfSteps', 'Number of Steps'),
+    ModelProperty('hasNumberOfProtcurAnnotations', 'Number of Protcur Annotations'),
+    ModelProperty('recordHash', 'MD5 hash')
+]
+
+TERM_SCHEMA = [
+    ModelProperty('label', 'Label', title=True), # is a list
+    ModelProperty('curie', 'CURIE'),
+    ModelProperty('definitions', 'Definition'), # is a list
+    ModelProperty('abbreviations', 'Abbreviations', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # is a list
+    ModelProperty('synonyms', 'Synonyms', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # is a list
+    ModelProperty('acronyms', 'Acronyms', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # is a list
+    ModelProperty('categories', 'Categories', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # is a list
+    ModelProperty('iri', 'IRI'),
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+RESEARCHER_SCHEMA = [
+    ModelProperty('lastName', 'Last name', title=True),
+    ModelProperty('firstName', 'First name'),
+    ModelProperty('middleName', 'Middle name'),
+    ModelProperty('hasAffiliation', 'Affiliation', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('hasRole', 'Role', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('hasORCIDId', 'ORCID iD', data_type=ModelPropertyType(
+        data_type=str, format='url')),
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+SAMPLE_SCHEMA = [
+    ModelProperty('label', 'Label', title=True),
+    ModelProperty('id', 'id'),
+    ModelProperty('description', 'Description'), # list
+    ModelProperty('hasAssignedGroup', 'Group', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('extractedFrom', 'Extract Location', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # filename list
+    ModelProperty('hasDigitalArtifactThatIsAboutIt', 'Digital artifact', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # filename list
+    #ModelProperty('hasDigitalArtifactThatIsAboutItHash', ), # list
+    ModelProperty('localExecutionNumber', 'Execution number', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('providerNote', 'Provider note', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+SUMMARY_SCHEMA = [
+    ModelProperty('title', 'Title', title=True), # list
+    # ModelProperty('hasResponsiblePrincipalInvestigator', 'Responsible Principal Investigator',
+    #             data_type=ModelPropertyEnumType(data_type=str, multi_select=True)),
+    # list of ORCID URLs, pennsieve user IDs, and, and pennsieve contributor URLs
+    # TODO: make this a relationship?
+    ModelProperty('isDescribedBy', 'Publication URL', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list (of urls)
+    ModelProperty('description', 'Description', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    # TODO: update dataset description using PUT /datasets/{id}/readme
+    ModelProperty('collectionTitle', 'Collection Title'),
+    ModelProperty('milestoneCompletionDate', 'Milestone Completion Date', data_type=ModelPropertyType(
+            data_type='date' )),
+    ModelProperty('curationIndex', 'Curation index'), # number string
+    ModelProperty('hasExperimentalModality', 'Experimental modality', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('hasNumberOfContributors', 'Number of contributors'), # number string
+    ModelProperty('hasNumberOfDirectories', 'Number of directories'), # number string
+    ModelProperty('hasNumberOfFiles', 'Number of files'), # number string
+    ModelProperty('hasNumberOfSamples', 'Number of samples'), # number string
+    ModelProperty('hasNumberOfSubjects', 'Number of subjects'), # number string
+    ModelProperty('acknowledgements', 'Acknowledgements'),
+    ModelProperty('submissionIndex', 'Submission index'), # number string
+    ModelProperty('errorIndex', 'Error index'), # number string
+    ModelProperty('label', 'Label'),
+    ModelProperty('hasSizeInBytes', 'Size (bytes)'), # number string
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+# Summary properties copied from the JSON node as (name, is_list)
+SUMMARY_FIELDS = (
+    ('isDescribedBy', True),
+    ('acknowledgements', False),
+    ('collectionTitle', False),
+    ('curationIndex', False),
+    ('description', True),
+    ('errorIndex', False),
+    ('hasExperimentalModality', True),
+    ('hasNumberOfContributors', False),
+    ('hasNumberOfDirectories', False),
+    ('hasNumberOfFiles', False),
+    ('hasNumberOfSamples', False),
+    ('hasNumberOfSubjects', False),
+    ('hasSizeInBytes', False),
+    ('label', False),
+    ('submissionIndex', False),
+)
+
+AWARD_SCHEMA = [
+    ModelProperty('award_id', 'Award ID', title=True),
+    ModelProperty('title', 'Title'),
+    ModelProperty('description', 'Description'),
+    ModelProperty('principal_investigator', 'Principal Investigator'),
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+HUMAN_SUBJECT_SCHEMA = [
+    ModelProperty('localId', 'Subject ID', title=True),
+    ModelProperty('subjectHasWeight', 'Weight', data_type=ModelPropertyType(
+        data_type=float, unit='g' )), # unit+value
+    ModelProperty('subjectHasHeight', 'Height'), # unit+value
+    ModelProperty('hasAge', 'Age',data_type=ModelPropertyType(
+        data_type=float, unit='s' )), # unit+value
+    ModelProperty('hasAssignedGroup', 'Group', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('spatialLocationOfModulator', 'Spatial location of modulator', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('stimulatorUtilized', 'Stimulator utilized'),
+    ModelProperty('providerNote', 'Provider note', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('hasGenotype', 'Genotype'),
+    ModelProperty('involvesAnatomicalRegion', 'Anatomical region involved'),
+    ModelProperty('wasAdministeredAnesthesia', 'Anesthesia administered'),
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+# The animal subject schema also has a hasAge property, typed by the units used in the dataset
+ANIMAL_SUBJECT_SCHEMA_HEAD = [
+    ModelProperty('localId', 'Subject ID', title=True),
+    ModelProperty('animalSubjectIsOfStrain', 'Animal strain'),
+    ModelProperty('animalSubjectHasWeight', 'Animal weight'), # unit+value
+]
+
+ANIMAL_SUBJECT_SCHEMA_TAIL = [
+    ModelProperty('protocolExecutionDate', 'Protocol execution date', data_type=ModelPropertyEnumType(
+        data_type='date', multi_select=True)), # list of MM-DD-YY strings
+    ModelProperty('localExecutionNumber', 'Execution number', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('hasAssignedGroup', 'Group', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('spatialLocationOfModulator', 'Spatial location of modulator', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    ModelProperty('stimulatorUtilized', 'Stimulator utilized'),
+    ModelProperty('providerNote', 'Provider note', data_type=ModelPropertyEnumType(
+        data_type=str, multi_select=True)), # list
+    #ModelProperty('localIdAlt', 'Alternate local id'),
+    ModelProperty('hasGenotype', 'Genotype'),
+    ModelProperty('involvesAnatomicalRegion', 'Anatomical region involved'),
+    ModelProperty('wasAdministeredAnesthesia', 'Anesthesia administered'),
+    ModelProperty('recordHash', 'MD5 hash'),
+]
+
+# Linked properties of human and animal subject records
+HUMAN_SUBJECT_LINKS = ('hasBiologicalSex', 'hasAgeCategory', 'specimenHasIdentifier')
+ANIMAL_SUBJECT_LINKS = ('animalSubjectIsOfSpecies',) + HUMAN_SUBJECT_LINKS
+
 ### ENTRY POINT
 
-def update_datasets(cfg, option = 'full', force_update = False, force_model = '', resume = False):
+def update_datasets(cfg, option = 'full', force_update = False, force_model = '', resume = False, workers = 1):
     """
     Update all datasets.
 
+    Datasets are independent of each other, so with workers > 1 they are
+    synchronized concurrently to overlap the platform API calls.
+
     Returns: list of datasets that failed to update
     """
     update_start_time = time()
 
-    oldJson = {}
-    newJson = get_json()
+    # The client keeps 10 connections per host by default, one per worker avoids new TLS handshakes
+    if workers > 10:
+        set_connection_pool_size(cfg.bf, workers)
 
     updated_ds_list = []
     if resume:
         updated_ds_list = get_resume_list(cfg.ttl_resume_file )
+    resumed_ds = set(updated_ds_list)
 
     # If specific datasets is updated, select only current dataset
+    datasets = iter_json()
     if option != 'full':
-        log.info("Updating dataset: {}".format(option))
-        ds_info = newJson[option]
-        newJson.clear()
-        newJson[option] = ds_info
+        log.info("Updating dataset: %s", option)
+        datasets = ((dsId, node) for dsId, node in datasets if dsId == option)
     else:
         log.info("Updating all datasets:")
 
@@ -85,33 +279,84 @@ def update_datasets(cfg, option = 'full', force_update = False, force_model = ''
     sync_recs = sync_rec_model.get_all(limit = 500)
     sync_dict = {x.get('ds_id'): x for x in sync_recs}
 
+    def finish(dsId, result):
+        if result is None:
+            # Dataset was skipped and should be retried on resume
+            return
+        elif not result:
+            failedDatasets.append(dsId)
+
+        updated_ds_list.append(dsId)
+        with open(cfg.ttl_resume_file , 'w') as f:
+            json.dump(updated_ds_list, f)
+
     # Iterate over Datasets in JSON file and add metadata records...
-    for dsId, node in newJson.items():
+    found = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for dsId, node in datasets:
+            found = True
+
+            # Check if already updated in resume_list
+            if dsId in resumed_ds:
+                log.info("--- Skipping due to resume: %s ---", dsId)
+                continue
 
-        # Check if already updated in resume_list
-        if dsId in updated_ds_list:
-            log.info("--- Skipping due to resume: {} ---".format(dsId))
-            continue
+            # Limit the datasets in flight, so the JSON file is not held in memory at once
+            if len(futures) >= 2 * workers:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(futures.pop(future), future.result())
 
-        # Create a new file-logger for this dataset
-        log_file_name = "/tmp/{}.log".format(dsId.replace(':','_'))
+            futures[executor.submit(update_dataset, cfg, dsId, node, sync_dict, sync_rec_model,
+                force_update, force_model)] = dsId
 
-        if force_update:
-            try:
-                os.remove(log_file_name)
-            except:
-                pass
+        for future in as_completed(futures):
+            finish(futures[future], future.result())
+
+    if option != 'full' and not found:
+        log.warning("Dataset %s is not in the metadata JSON file", option)
+        failedDatasets.append(option)
+
+    # Timing stats
+    duration = int((time() - update_start_time) * 1000)
+    log.info("Update datasets in %s milliseconds", duration)
+
+    log.info("Failed Datasets: %s", failedDatasets)
 
-        filehandler = logging.FileHandler(log_file_name, 'a')
-        for hdlr in log.handlers[:]:  # remove the existing file handlers
-            if isinstance(hdlr,logging.FileHandler):
-                log.removeHandler(hdlr)
-        filehandler.setLevel(logging.INFO)
-        log.addHandler(filehandler)
+    # Update dashboard when complete when running in production.
+    if cfg.env == 'prod':
+        update_sparc_dashboard(cfg.bf)
 
+    return failedDatasets
+
+def update_dataset(cfg, dsId, node, sync_dict, sync_rec_model, force_update = False, force_model = ''):
+    """
+    Update a single dataset.
+
+    Returns: False if the dataset failed to update, None if it was skipped
+    """
+
+    # Create a new file-logger for this dataset
+    log_file_name = "/tmp/{}.log".format(dsId.replace(':','_'))
+
+    if force_update:
+        try:
+            os.remove(log_file_name)
+        except:
+            pass
+
+    # Only capture records logged by the thread that handles this dataset
+    thread_id = threading.get_ident()
+    filehandler = logging.FileHandler(log_file_name, 'a')
+    filehandler.setLevel(logging.INFO)
+    filehandler.addFilter(lambda record: record.thread == thread_id)
+    log.addHandler(filehandler)
+
+    try:
         log.warning('=== +++ ===')
-        log.warning('--- {} ==='.format(dsId))
-        log.warning('--- {} ---'.format(str(DT.now())))
+        log.warning('--- %s ===', dsId)
+        log.warning('--- %s ---', DT.now())
         log.warning('=== +++ ===')
 
         # Create empty cache for records/models
@@ -119,10 +364,10 @@ def update_datasets(cfg, option = 'full', force_update = False, force_model = ''
 
         # Check if dataset exist in sync_dict
         if dsId in sync_dict:
-            log.info("found record: {}".format(dsId))
+            log.info("found record: %s", dsId)
             sync_rec = sync_dict[dsId]
         else:
-            log.info("Did not fiund record: {}".format(dsId))
+            log.info("Did not fiund record: %s", dsId)
             sync_rec = sync_rec_model.create_record({'ds_id': dsId})
 
         # Check which records should be updated
@@ -148,7 +393,7 @@ def update_datasets(cfg, option = 'full', force_update = False, force_model = ''
 
         # If force model is set, then always update provided model
         if force_model:
-            log.info("Found Force Model: {}".format(force_model))
+            log.info("Found Force Model: %s", force_model)
             update_recs[force_model] = True
 
         log.info('---')
@@ -165,8 +410,10 @@ def update_datasets(cfg, option = 'full', force_update = False, force_model = ''
 
                 # Check that curation bot has manager access
                 if cfg.env=='prod' and not has_bf_access(ds):
-                    log.warning('UNABLE TO UPDATE DATASET DUE TO PERMISSIONS: {}'.format(dsId))
-                    continue
+                    log.warning('UNABLE TO UPDATE DATASET DUE TO PERMISSIONS: %s', dsId)
+                    return None
+
+                sync_values = sync_rec.values
 
                 # Create all records
                 add_data(cfg.bf, ds, dsId, record_cache, node, sync_rec, update_recs, force_model)
@@ -177,85 +424,79 @@ def update_datasets(cfg, option = 'full', force_update = False, force_model = ''
                 # Add Dataset tag
                 add_tags(cfg.bf, ds, node['tag'], sync_rec, update_recs)
 
-                # Update Sync Records
-                log.info('UPDATING SYNC RECORD')
-                sync_rec.update()
+                # Update Sync Records, unless all hashes were already current (e.g. force_update)
+                if sync_rec.values != sync_values:
+                    log.info('UPDATING SYNC RECORD')
+                    sync_rec.update()
+                else:
+                    log.info('Sync record is unchanged, skipping update')
             else:
                 log.info('=== No Records changed, skipping dataset ===')
 
         except (pennsieveException, Exception) as e:
             # raise
-            log.error("Dataset {} failed to update".format(dsId))
+            log.error("Dataset %s failed to update", dsId)
             log.error(e)
-            failedDatasets.append(dsId)
-            # continue
-
-
-        updated_ds_list.append(dsId)
-        with open(cfg.ttl_resume_file , 'w') as f:
-            json.dump(updated_ds_list, f)
+            return False
 
         log.info('===========================')
+        return True
 
-    # Timing stats
-    duration = int((time() - update_start_time) * 1000)
-    log.info("Update datasets in {} milliseconds".format(duration))
-
-    log.info("Failed Datasets: {}".format(failedDatasets))
-
-    # Update dashboard when complete when running in production.
-    if cfg.env == 'prod':
-        update_sparc_dashboard(cfg.bf)
-
-    return
+    finally:
+        log.removeHandler(filehandler)
+        filehandler.close()
 
 ### CORE METHODS
 def get_all_records_from_remote(model, record_cache):
     all_record_hashes = []
     record_cache[model.type] = {}
-    nr_records = model.count
     batch_size = 500
-    for count in range(math.ceil(nr_records/batch_size) ):
-        records = model.get_all(limit=batch_size, offset=count*batch_size)
+    offset = 0
+    # Page until a short batch instead of trusting model.count, which is
+    # fixed when the model is fetched and goes stale for cached models.
+    while True:
+        records = model.get_all(limit=batch_size, offset=offset)
         record_cache[model.type].update({record.id: record for record in records})
         all_record_hashes.extend([record.values['recordHash'] for record in records])
+        if len(records) < batch_size:
+            break
+        offset += batch_size
 
     return all_record_hashes
 
 def get_record_by_hash(model_name, hash, record_cache):
     for record in record_cache[model_name].values():
-        print(record.values)
         if record.values['recordHash'] == hash:
             return record
 
     return None
 
+## Platform model name --> JSON model identifier
+JSON_MODEL_NAMES = {
+    'protocol': 'protocol',
+    'summary': 'summary',
+    'subject': 'subject',
+    'animal_subject': 'subject',
+    'human_subject': 'subject',
+    'tag': 'tag',
+    'sample': 'sample',
+    'researcher': 'researcher',
+    'award': 'award',
+    'term': 'term'}
+
 def map_target_to_json_model(target_name):
     """Maps between platform model name and JSON model identifier
     """
-
-    if target_name == 'protocol':
-        return 'protocol'
-    elif target_name == 'summary':
-        return 'summary'
-    elif target_name == 'subject':
-        return 'subject'
-    elif target_name == 'animal_subject':
-        return 'subject'
-    elif target_name == 'human_subject':
-        return 'subject'
-    elif target_name == 'tag':
-        return 'tag'
-    elif target_name == 'sample':
-        return 'sample'
-    elif target_name == 'researcher':
-        return 'researcher'
-    elif target_name == 'award':
-        return 'award'
-    elif target_name == 'term':
-        return 'term'
+    return JSON_MODEL_NAMES.get(target_name)
 
 def get_record_id_from_node(bf, ds, model, json_id, json_node, record_cache):
+    """Return the id of the record found by get_record_from_node, or None"""
+    record = get_record_from_node(bf, ds, model, json_id, json_node, record_cache)
+    if record:
+        return record.id
+    return None
+
+def get_record_from_node(bf, ds, model, json_id, json_node, record_cache):
     """Find record based on json_node id or full json node
 
     Checks if JSON Node ID is already available in cache. If not, then search
@@ -264,8 +505,7 @@ def get_record_id_from_node(bf, ds, model, json_id, json_node, record_cache):
 
     if json_id in record_cache[model.type]:
         # Get directly from cache derived from JSON File
-        record = record_cache[model.type][json_id]
-        return record.id
+        return record_cache[model.type][json_id]
     else:
         ''' Get all records from Platform if needed and run local search
             This happens when we expect to have to find a lot of records of this type of model
@@ -282,15 +522,15 @@ def get_record_id_from_node(bf, ds, model, json_id, json_node, record_cache):
 
         if result:
             log.debug('Found result in fetched records')
-            return result.id
+            return result
         else:
             result = find_target_record_remotely(bf, ds, model.type, json_node, json_id)
 
             if result:
                 record_cache[model.type][json_id] = model.get(result['id'])
-                return result['id']
+                return record_cache[model.type][json_id]
             else:
-                log.debug('Cannot find item in cache or on Platform: {}'.format(json_id))
+                log.debug('Cannot find item in cache or on Platform: %s', json_id)
                 return None
 
 def field_matches_value(sub_node, field, value):
@@ -306,7 +546,7 @@ def find_target_record_locally(target_type, json_node, json_id, record_cache):
 
     target_records = record_cache[target_type]
 
-    log.debug('Finding locally on {} records'.format(len(target_records)))
+    log.debug('Finding locally on %s records', len(target_records))
 
     if target_type == 'award':
         # Award can be identified by
@@ -394,15 +634,15 @@ def find_target_record_remotely(bf, ds, target_type, json_node, json_id):
     else:
         return None
 
-    log.debug("Searching for node with filter:  {} - {}".format(target_type, record_filter))
+    log.debug("Searching for node with filter:  %s - %s", target_type, record_filter)
 
     out = search_for_records(bf, ds, target_type, record_filter)
 
-    log.debug("Result of search: {}".format(out))
+    log.debug("Result of search: %s", out)
 
     return out
 
-def update_records(bf, ds, sub_node, model_name, record_cache, model_create_fnc, transform_fnc, sub_type=None, exclude_sub_type=None, update_all=False):
+def update_records(bf, ds, sub_node, model_name, record_cache, model_create_fnc, transform_fnc, sub_type=None, exclude_sub_type=None, update_all=False, prefetch_fnc=None):
     """Creates records for particular Model in Dataset
 
     This method takes the sub_node for a particular model in a dataset and create the records.
@@ -429,6 +669,10 @@ def update_records(bf, ds, sub_node, model_name, record_cache, model_create_fnc,
 
     update_all: bool
 
+    prefetch_fnc: function()
+        Optional function that is called with the JSON nodes that will be
+        transformed, before transform_fnc is called on any of them
+
     """
 
     # When we need to update the records, we need to get all records locally to compare the hash.
@@ -437,54 +681,46 @@ def update_records(bf, ds, sub_node, model_name, record_cache, model_create_fnc,
 
     ## Get Model-unit map for dataset
     unit_map = get_unit_map(sub_node)
-    model = model_create_fnc(bf, ds, unit_map)
 
-    log.info("model_type:{}".format(model_name))
+    log.info("model_type:%s", model_name)
     # model = get_bf_model(ds, model_name)
-    all_record_hashes = []
+    all_record_hashes = set()
     if update_all:
+        # No need to get the model first, it is removed and recreated
         clear_model(bf, ds, model_name)
         model = model_create_fnc(bf, ds, unit_map)
     else:
-        all_record_hashes = get_all_records_from_remote(model, record_cache)
-
-    record_list = []
-    json_id_list = []
-    all_json_hashes = []
-    for record_id, sub_node in sub_node.items():
-        all_json_hashes.append(sub_node['hash'])
+        model = model_create_fnc(bf, ds, unit_map)
+        all_record_hashes = set(get_all_records_from_remote(model, record_cache))
 
+    def needs_update(node):
         # Only append to list those who need appending
-        if sub_node['hash'] not in all_record_hashes or update_all:
-            # Skip if a subtype is provided and record does not have subtype
-            if sub_type and not field_matches_value(sub_node, 'animalSubjectIsOfSpecies', sub_type):
-                continue
-            # Skip if an exclusion criteria is provided and subtype matches exclusion
-            elif exclude_sub_type and field_matches_value(sub_node, 'animalSubjectIsOfSpecies', exclude_sub_type):
-                continue
-            else:
-                log.info("{}:{}".format(record_id,sub_node))
-                record_list.append(transform_fnc(record_id, sub_node, unit_map))
-                json_id_list.append("{}".format( record_id ))
-
+        if node['hash'] in all_record_hashes and not update_all:
+            return False
+        # Skip if a subtype is provided and record does not have subtype
+        if sub_type and not field_matches_value(node, 'animalSubjectIsOfSpecies', sub_type):
+            return False
+        # Skip if an exclusion criteria is provided and subtype matches exclusion
+        if exclude_sub_type and field_matches_value(node, 'animalSubjectIsOfSpecies', exclude_sub_type):
+            return False
+        return True
 
+    all_json_hashes = {node['hash'] for node in sub_node.values()}
+    nodes = [(record_id, node) for record_id, node in sub_node.items() if needs_update(node)]
+    if prefetch_fnc is not None and nodes:
+        prefetch_fnc([node for _, node in nodes])
+    items = [(str(record_id), transform_fnc(record_id, node, unit_map))
+        for record_id, node in nodes]
 
-    if len(record_list):
-        log.info('Creating {} new {} Records'.format(len(record_list), model_name))
+    if items:
+        json_id_list, record_list = (list(x) for x in zip(*items))
+        log.info('Creating %s new %s Records: %s', len(record_list), model_name, json_id_list)
 
-        # Add batches of max 100 records
+        # Add batches of max 100 records. A failed batch raises, so the stale records
+        # are kept and the model hash is not stored, and the next run retries them.
         n = 100
-        nr_batches = math.floor(len(record_list) /n )
-        if nr_batches > 1:
-            for i in range(0, nr_batches):
-                record_cache[model_name].update(zip(json_id_list[i*n:(i*n+n)], model.create_records(record_list[i*n:(i*n+n)])))
-
-            record_cache[model_name].update(zip(json_id_list[(i+1)*n:], model.create_records(record_list[(i+1)*n:])))
-        else:
-            try:
-                record_cache[model_name].update(zip(json_id_list, model.create_records(record_list)))
-            except Exception as e:
-                log.warning('Unable to add records because: {}', str(e))
+        for i in range(0, len(record_list), n):
+            record_cache[model_name].update(zip(json_id_list[i:i+n], model.create_records(record_list[i:i+n])))
 
         log.debug('Finished creating records')
 
@@ -496,10 +732,10 @@ def update_records(bf, ds, sub_node, model_name, record_cache, model_create_fnc,
     for hash in all_record_hashes:
         if hash not in all_json_hashes:
             rec = get_record_by_hash(model_name, hash, record_cache)
-            log.info("Record to be removed: {}".format(rec))
+            log.info("Record to be removed: %s", rec)
             remove_recs.append(rec)
 
-    log.info("To be removed: {}".format({record.id for record in remove_recs}))
+    log.info("To be removed: %s", {record.id for record in remove_recs})
     model.delete_records(*remove_recs)
 
 def update_record_files(bf, ds, sub_node, model_name, record_cache):
@@ -512,10 +748,10 @@ def update_record_files(bf, ds, sub_node, model_name, record_cache):
                     linked_file_id = strip_iri(linked_file)
                     log.info(record_cache[model_name])
                     record_id = record_cache[model_name][record_name].id
-                    log.info("Adding link to: {}".format(linked_file_id))
+                    log.info("Adding link to: %s", linked_file_id)
                     add_file_to_record(bf, ds, record_id, linked_file_id)
     except Exception as e:
-        log.warning('Unable to add file to record of model: {}'.format(model_name))
+        log.warning('Unable to add file to record of model: %s', model_name)
 
 
 def add_data(bf, ds, dsId, record_cache, node, sync_rec, update_recs, force_model):
@@ -540,10 +776,6 @@ def add_data(bf, ds, dsId, record_cache, node, sync_rec, update_recs, force_mode
 
     """
 
-    # Get Models
-    models = ds.models()
-
-
     # Adding all records without setting linked properties and relationships
     if update_recs['protocol']:
         log.info('Updating protocol')
@@ -655,16 +887,11 @@ def add_random_terms(ds, label, record_cache):
 
     """
 
-    if not hasattr(add_random_terms, "term_model"):
-        add_random_terms.term_model = get_bf_model(ds, 'term')
-        add_random_terms.model_ds = ds.id
-    elif add_random_terms.model_ds != ds.id:
-        add_random_terms.term_model = get_bf_model(ds, 'term')
-        add_random_terms.model_ds = ds.id
+    term_model = get_bf_model(ds, 'term')
 
-    log.debug("Adding random term: {}".format(label))
+    log.debug("Adding random term: %s", label)
 
-    record = add_random_terms.term_model.create_record({'label': label})
+    record = term_model.create_record({'label': label})
     record_cache['term'][label] = record
     return record
 
@@ -691,7 +918,7 @@ def add_record_links(bf, ds, record_cache, model, record_id, links, ds_node):
 
     """
 
-    log.debug('Adding Record Linked Properties for {}-{}'.format(model, record_id))
+    log.debug('Adding Record Linked Properties for %s-%s', model, record_id)
     payload =  []
     for name, value in links.items():
         # name: name of property to add,
@@ -713,13 +940,12 @@ def add_record_links(bf, ds, record_cache, model, record_id, links, ds_node):
         # Find model name of the linked property target
         target_model = get_bf_model(ds, linkedProp.target)
         targetType = target_model.type
+        json_model_name = map_target_to_json_model(targetType)
 
         # We can have an array of links per property
         linked_rec_id = None
         for json_id in valueList:
             # Check if value is in the record cache
-            json_model_name = map_target_to_json_model(targetType)
-
             item_node = []
             if json_id in ds_node[json_model_name]:
                 item_node =  ds_node[json_model_name][json_id]
@@ -732,7 +958,7 @@ def add_record_links(bf, ds, record_cache, model, record_id, links, ds_node):
                     linked_rec = add_random_terms(ds, json_id, record_cache)
                     linked_rec_id = linked_rec.id
                 else:
-                    log.warning('UNABLE to LINK ({}:{}) to non-existing record ({}:{})'.format(model.type, record_id, targetType, json_id))
+                    log.warning('UNABLE to LINK (%s:%s) to non-existing record (%s:%s)', model.type, record_id, targetType, json_id)
 
             if linked_rec_id:
                 payload.append({
@@ -741,13 +967,13 @@ def add_record_links(bf, ds, record_cache, model, record_id, links, ds_node):
                     "to": linked_rec_id
                 })
 
-    log.debug("Updating Linked Properties: {} : record ID: {}".format(payload, record_id))
+    log.debug("Updating Linked Properties: %s : record ID: %s", payload, record_id)
     if len(payload):
         create_links(bf, ds, model.id, record_id, payload)
 
 def add_record_relationships(bf, ds, record_cache, model, record, relationships, ds_node):
 
-    log.debug('Adding Record Relationships for {}'.format(record.id))
+    log.debug('Adding Record Relationships for %s', record.id)
     # Iterate over all relationships in a record
     for name, value in relationships.items():
         targetRecordList = []
@@ -767,31 +993,33 @@ def add_record_relationships(bf, ds, record_cache, model, record, relationships,
         else:
             raise(Exception('Incorrect type for relationship node.'))
 
+        # Because json-model name can be different than Platform model name (e.g. Subject vs Animal_Subject)
+        json_model_name = map_target_to_json_model(targetModel)
+
         # Iterate over all items with particular relationship to record
         for json_id in valueList:
 
-            # Because json-model name can be different than Platform model name (e.g. Subject vs Animal_Subject)
-            json_model_name = map_target_to_json_model(targetModel)
-
             item_node = []
             if json_id in ds_node[json_model_name]:
                 item_node =  ds_node[json_model_name][json_id]
 
                 # Find item in cache or platform
-                linked_rec_id = get_record_id_from_node(bf, ds, target_model_instance, json_id, item_node, record_cache )
+                # Use the cached record object, instead of fetching it again by id
+                linked_rec = get_record_from_node(bf, ds, target_model_instance, json_id, item_node, record_cache )
 
-                if linked_rec_id:
-                    targetRecordList.append(target_model_instance.get(linked_rec_id))
+                if linked_rec:
+                    targetRecordList.append(linked_rec)
                 elif targetModel == 'term':
-                    log.debug("Adding a string term to the dataset: {}".format(json_id))
+                    log.debug("Adding a string term to the dataset: %s", json_id)
                     linked_rec = add_random_terms(ds, json_id, record_cache)
                     targetRecordList.append(linked_rec)
                 else:
-                    log.warning('UNABLE to RELATE record ({}) to non-existing record {}:{}'.format(record.id, targetModel, json_id))
+                    log.warning('UNABLE to RELATE record (%s) to non-existing record %s:%s', record.id, targetModel, json_id)
 
         # Add to list
         if len(targetRecordList) > 0:
-            record.relate_to(targetRecordList, name)
+            relationship = get_bf_relationship(ds, name, model, target_model_instance)
+            record.relate_to(targetRecordList, relationship)
 
 def add_tags(bf, ds, sub_node, sync_rec, update_recs):
     """Adding Dataset Tags based on the Tags defined in the TTL file
@@ -812,12 +1040,15 @@ def add_tags(bf, ds, sub_node, sync_rec, update_recs):
         if not tags:
             tags = ['SPARC']
 
-        ds.tags = list(set(tags))
-        ds.update()
+        # Only update the dataset when its tags actually change
+        tags = list(dict.fromkeys(tags))
+        if set(tags) != set(ds.tags or ()):
+            ds.tags = tags
+            ds.update()
 
         sync_rec._set_value('tag', get_recordset_hash(sub_node))
     else:
-        print('Skipping tag')
+        log.info('Skipping tag')
 
 def get_unit_map(sub_node):
     """Get dict with unit for property
@@ -835,9 +1066,9 @@ def get_unit_map(sub_node):
                 if 'unit' in value:
                     if key in out:
                         if value['unit'] != out[key]['unit'] and out[key]['unit'] != '(no unit)':
-                            log.warning("Multiple units for model-property in single dataset: {} and {}".format(value['unit'], out[key]['unit']))
+                            log.warning("Multiple units for model-property in single dataset: %s and %s", value['unit'], out[key]['unit'])
                         if out[key]['is_num'] != is_number(value['value']):
-                            log.warning("Not all values are parseable as floats: {}".format(value['value']))
+                            log.warning("Not all values are parseable as floats: %s", value['value'])
                             out[key]['is_num'] = False
                     else:
                         if value['unit']:
@@ -860,17 +1091,7 @@ def add_protocols(bf, ds, record_cache, sub_node, update_all):
     log.info("Adding protocols...")
 
     def create_model(bf, ds, unit_map):
-        return get_create_model(bf, ds, 'protocol', 'Protocol', schema=[
-            ModelProperty('label', 'Name', title=True),
-            ModelProperty('url', 'URL',data_type=ModelPropertyType(
-                    data_type=str, format='url')),
-            ModelProperty('publisher', 'publisher'),
-            ModelProperty('date', 'Date', data_type=ModelPropertyType(
-                    data_type='date' )),
-            ModelProperty('protocolHasNumberOfSteps', 'Number of Steps'),
-            ModelProperty('hasNumberOfProtcurAnnotations', 'Number of Protcur Annotations'),
-            ModelProperty('recordHash', 'MD5 hash')
-        ])
+        return get_create_model(bf, ds, 'protocol', 'Protocol', schema=PROTOCOL_SCHEMA)
 
     def transform(record_id, sub_node, unit_map):
 
@@ -902,23 +1123,7 @@ def add_protocols(bf, ds, record_cache, sub_node, update_all):
 def add_terms(bf, ds, record_cache, sub_node, update_all):
 
     def create_model(bf, ds, unit_map):
-        return get_create_model(bf, ds, 'term', 'Term', schema=[
-                ModelProperty('label', 'Label', title=True), # is a list
-                ModelProperty('curie', 'CURIE'),
-                ModelProperty('definitions', 'Definition'), # is a list
-                ModelProperty('abbreviations', 'Abbreviations', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # is a list
-                ModelProperty('synonyms', 'Synonyms', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # is a list
-                ModelProperty('acronyms', 'Acronyms', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # is a list
-                ModelProperty('categories', 'Categories', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # is a list
-                ModelProperty('iri', 'IRI'),
-                ModelProperty('recordHash', 'MD5 hash'),
-
-            ]
-        )
+        return get_create_model(bf, ds, 'term', 'Term', schema=TERM_SCHEMA)
 
     def transform(record_id, term, unit_map):
         return {
@@ -930,7 +1135,7 @@ def add_terms(bf, ds, record_cache, sub_node, update_all):
             'acronyms': term.get('acronyms'),
             'categories': term.get('categories'),
             'iri': term.get('iri'),
-            'recordHash': sub_node.get('hash'),
+            'recordHash': term.get('hash'),
         }
 
     update_records(bf, ds, sub_node, "term", record_cache,  create_model, transform, update_all=update_all)
@@ -938,18 +1143,7 @@ def add_terms(bf, ds, record_cache, sub_node, update_all):
 def add_researchers(bf, ds, record_cache, sub_node, update_all):
 
     def create_model(bf, ds, unit_map):
-        return get_create_model(bf, ds, 'researcher', 'Researcher', schema=[
-                ModelProperty('lastName', 'Last name', title=True),
-                ModelProperty('firstName', 'First name'),
-                ModelProperty('middleName', 'Middle name'),
-                ModelProperty('hasAffiliation', 'Affiliation', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('hasRole', 'Role', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('hasORCIDId', 'ORCID iD', data_type=ModelPropertyType(
-                    data_type=str, format='url')),
-                ModelProperty('recordHash', 'MD5 hash'),
-        ])
+        return get_create_model(bf, ds, 'researcher', 'Researcher', schema=RESEARCHER_SCHEMA)
 
     def transform(record_id, sub_node, unit_map):
         return {
@@ -970,25 +1164,7 @@ def add_subjects(bf, ds, record_cache, sub_node, update_all):
     ## Define Model Generators
     def create_human_model(bf, ds, unit_map):
         return get_create_model(bf, ds, 'human_subject', 'Human Subject',
-            schema = [
-                ModelProperty('localId', 'Subject ID', title=True),
-                ModelProperty('subjectHasWeight', 'Weight', data_type=ModelPropertyType(
-                    data_type=float, unit='g' )), # unit+value
-                ModelProperty('subjectHasHeight', 'Height'), # unit+value
-                ModelProperty('hasAge', 'Age',data_type=ModelPropertyType(
-                    data_type=float, unit='s' )), # unit+value
-                ModelProperty('hasAssignedGroup', 'Group', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('spatialLocationOfModulator', 'Spatial location of modulator', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('stimulatorUtilized', 'Stimulator utilized'),
-                ModelProperty('providerNote', 'Provider note', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('hasGenotype', 'Genotype'),
-                ModelProperty('involvesAnatomicalRegion', 'Anatomical region involved'),
-                ModelProperty('wasAdministeredAnesthesia', 'Anesthesia administered'),
-                ModelProperty('recordHash', 'MD5 hash'),
-            ], linked=[
+            schema=HUMAN_SUBJECT_SCHEMA, linked=[
                 LinkedModelProperty('hasBiologicalSex', term_model, 'Biological sex'), # list (this is a bug)
                 LinkedModelProperty('hasAgeCategory', term_model, 'Age category'),
                 LinkedModelProperty('specimenHasIdentifier', term_model, 'Identifier'),
@@ -1007,28 +1183,8 @@ def add_subjects(bf, ds, record_cache, sub_node, update_all):
 
 
         return get_create_model(bf, ds, 'animal_subject', 'Animal Subject',
-            schema=[
-                ModelProperty('localId', 'Subject ID', title=True),
-                ModelProperty('animalSubjectIsOfStrain', 'Animal strain'),
-                ModelProperty('animalSubjectHasWeight', 'Animal weight'), # unit+value
-                has_age_model_prop,
-                ModelProperty('protocolExecutionDate', 'Protocol execution date', data_type=ModelPropertyEnumType(
-                    data_type='date', multi_select=True)), # list of MM-DD-YY strings
-                ModelProperty('localExecutionNumber', 'Execution number', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('hasAssignedGroup', 'Group', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('spatialLocationOfModulator', 'Spatial location of modulator', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('stimulatorUtilized', 'Stimulator utilized'),
-                ModelProperty('providerNote', 'Provider note', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                #ModelProperty('localIdAlt', 'Alternate local id'),
-                ModelProperty('hasGenotype', 'Genotype'),
-                ModelProperty('involvesAnatomicalRegion', 'Anatomical region involved'),
-                ModelProperty('wasAdministeredAnesthesia', 'Anesthesia administered'),
-                ModelProperty('recordHash', 'MD5 hash'),
-            ], linked=[
+            schema=ANIMAL_SUBJECT_SCHEMA_HEAD + [has_age_model_prop] + ANIMAL_SUBJECT_SCHEMA_TAIL,
+            linked=[
                 LinkedModelProperty('animalSubjectIsOfSpecies', term_model, 'Animal species'),
                 # LinkedModelProperty('animalSubjectIsOfStrain', term_model, 'Animal strain'),
                 LinkedModelProperty('hasBiologicalSex', term_model, 'Biological sex'), # list (this is a bug)
@@ -1133,59 +1289,28 @@ def add_subject_links(bf, ds, record_cache, sub_node_name, ds_node):
         # No models for subject defined
         return
 
+    if model is None:
+        return
 
-    def transform_human(sub_node, localId):
-        links = {
-            'hasBiologicalSex': sub_node.get('hasBiologicalSex'),
-            'hasAgeCategory': sub_node.get('hasAgeCategory'),
-            'specimenHasIdentifier':sub_node.get('specimenHasIdentifier')
-        }
-        return links
-
-    def transform_animal(sub_node, localId):
-        links = {
-            'animalSubjectIsOfSpecies': sub_node.get('animalSubjectIsOfSpecies'),
-            'hasBiologicalSex': sub_node.get('hasBiologicalSex'),
-            'hasAgeCategory': sub_node.get('hasAgeCategory'),
-            'specimenHasIdentifier':sub_node.get('specimenHasIdentifier')
-        }
-        return links
+    link_names = HUMAN_SUBJECT_LINKS if subtype == 'homo sapiens' else ANIMAL_SUBJECT_LINKS
 
     for subj_id, subj_node in sub_node.items():
         record_id = get_record_id_from_node(bf, ds, model, subj_id, sub_node, record_cache)
 
         if record_id:
-            if subtype == 'homo sapiens':
-                links = transform_human(subj_node, subj_id)
-            else:
-                links = transform_animal(subj_node, subj_id)
+            # Only pass the links that are set for this subject
+            links = {name: subj_node[name] for name in link_names if name in subj_node}
 
             add_record_links(bf, ds, record_cache, model, record_id, links, ds_node)
         else:
-            log.warning('Trying to link to a subject record ({}) that does not exist.'.format(record_id  ))
+            log.warning('Trying to link to a subject record (%s) that does not exist.', record_id)
 
 def add_samples(bf, ds, record_cache, sub_node, update_all):
 
     def create_sample_model(bf, ds, unit_map):
 
         return get_create_model(bf, ds, 'sample', 'Sample',
-            schema=[
-                ModelProperty('label', 'Label', title=True),
-                ModelProperty('id', 'id'),
-                ModelProperty('description', 'Description'), # list
-                ModelProperty('hasAssignedGroup', 'Group', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('extractedFrom', 'Extract Location', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # filename list
-                ModelProperty('hasDigitalArtifactThatIsAboutIt', 'Digital artifact', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # filename list
-                #ModelProperty('hasDigitalArtifactThatIsAboutItHash', ), # list
-                ModelProperty('localExecutionNumber', 'Execution number', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('providerNote', 'Provider note', data_type=ModelPropertyEnumType(
-                    data_type=str, multi_select=True)), # list
-                ModelProperty('recordHash', 'MD5 hash'),
-            ])
+            schema=SAMPLE_SCHEMA)
 
     def transform(record_id, sub_node, unit_map):
         return {
@@ -1215,13 +1340,8 @@ def add_sample_links(bf, ds, record_cache, sub_node_name, ds_node):
         # Check if Human or Animal Subjects in Model or create new
         # generic model to support linked property "derivedFromSubject"
         # Assuming no datasets with both human, and animal subjects
-        models = ds.models()
-        subModel = None
-        if 'human_subject' in models:
-            subModel = models['human_subject']
-        elif 'animal_subject' in models:
-            subModel = models['animal_subject']
-        else:
+        subModel = get_bf_model(ds, 'human_subject') or get_bf_model(ds, 'animal_subject')
+        if subModel is None:
             clear_model(bf, ds, 'subject')
             subModel = get_create_model(bf, ds, 'subject', 'Subject',
                 schema=[
@@ -1237,8 +1357,7 @@ def add_sample_links(bf, ds, record_cache, sub_node_name, ds_node):
     def transform_sample(sub_node):
         subj_id = None
         if 'wasDerivedFromSubject' in sub_node:
-            regex = re.compile(r'.*/subjects/(.+)')
-            subj_id = regex.match(sub_node['wasDerivedFromSubject']).group(1)
+            subj_id = SUBJECT_IRI_RE.match(sub_node['wasDerivedFromSubject']).group(1)
 
         links = {
             'wasDerivedFromSubject': subj_id,
@@ -1255,69 +1374,48 @@ def add_sample_links(bf, ds, record_cache, sub_node_name, ds_node):
     # Add Property links to model
     model = updateModel(bf, ds)
 
+    # Packages found per digital artifact, so each file is searched for once
+    file_pkgs = {}
+
+    # Records to relate to each package, so every package is related once
+    pkg_records = {}
+
     # Iterate over multiple subject records, single dataset
     for sampleId, subj_node in sub_node.items():
-        record_id = get_record_id_from_node(bf, ds, model, sampleId, subj_node, record_cache)
+        record = get_record_from_node(bf, ds, model, sampleId, subj_node, record_cache)
 
-        if record_id:
+        if record:
             out = transform_sample(subj_node)
 
             # Adding Linked Properties
-            add_record_links(bf, ds, record_cache, model, record_id, out['links'], ds_node)
+            add_record_links(bf, ds, record_cache, model, record.id, out['links'], ds_node)
 
             # Adding Relationships
-            record = model.get(record_id) #TODO: Remove this
             rels = out['relationships']
             add_record_relationships(bf, ds, record_cache, model, record, out['relationships'], ds_node)
 
             # Associate files with Samples
             if sub_node.get('hasDigitalArtifactThatIsAboutIt') is not None:
                 for fullFileName in sub_node.get('hasDigitalArtifactThatIsAboutIt'):
-                    log.info('Adding File Links: {}'.format(fullFileName))
-                    filename, file_extension = os.path.splitext(fullFileName)
-                    pkgs = ds.get_packages_by_filename(filename)
-                    if len(pkgs) > 0:
-                        for pkg in pkgs:
-                            pkg.relate_to(record)
+                    log.info('Adding File Links: %s', fullFileName)
+                    if fullFileName not in file_pkgs:
+                        filename, file_extension = os.path.splitext(fullFileName)
+                        file_pkgs[fullFileName] = ds.get_packages_by_filename(filename)
+                    for pkg in file_pkgs[fullFileName]:
+                        pkg_records.setdefault(pkg.id, (pkg, []))[1].append(record)
 
         else:
-            log.warning('Trying to link to a sample record ({}) that does not exist.'.format( record_id ))
+            log.warning('Trying to link to a sample record (%s) that does not exist.', sampleId)
+
+    for pkg, records in pkg_records.values():
+        pkg.relate_to(*records)
 
 def add_summary(bf, ds, record_cache, sub_node, update_all):
     log.info("Adding summary...")
 
     def create_model(bf, ds, unit_map):
-        return get_create_model(bf, ds, 'summary', 'Summary', schema=[
-            ModelProperty('title', 'Title', title=True), # list
-            # ModelProperty('hasResponsiblePrincipalInvestigator', 'Responsible Principal Investigator',
-            #             data_type=ModelPropertyEnumType(data_type=str, multi_select=True)),
-            # list of ORCID URLs, pennsieve user IDs, and, and pennsieve contributor URLs
-            # TODO: make this a relationship?
-            ModelProperty('isDescribedBy', 'Publication URL', data_type=ModelPropertyEnumType(
-                data_type=str, multi_select=True)), # list (of urls)
-            ModelProperty('description', 'Description', data_type=ModelPropertyEnumType(
-                data_type=str, multi_select=True)), # list
-            # TODO: update dataset description using PUT /datasets/{id}/readme
-            ModelProperty('collectionTitle', 'Collection Title'),
-            ModelProperty('milestoneCompletionDate', 'Milestone Completion Date', data_type=ModelPropertyType(
-                    data_type='date' )),
-            ModelProperty('curationIndex', 'Curation index'), # number string
-            ModelProperty('hasExperimentalModality', 'Experimental modality', data_type=ModelPropertyEnumType(
-                data_type=str, multi_select=True)), # list
-            ModelProperty('hasNumberOfContributors', 'Number of contributors'), # number string
-            ModelProperty('hasNumberOfDirectories', 'Number of directories'), # number string
-            ModelProperty('hasNumberOfFiles', 'Number of files'), # number string
-            ModelProperty('hasNumberOfSamples', 'Number of samples'), # number string
-            ModelProperty('hasNumberOfSubjects', 'Number of subjects'), # number string
-            ModelProperty('acknowledgements', 'Acknowledgements'),
-            ModelProperty('submissionIndex', 'Submission index'), # number string
-            ModelProperty('errorIndex', 'Error index'), # number string
-            ModelProperty('label', 'Label'),
-            ModelProperty('hasSizeInBytes', 'Size (bytes)'), # number string
-            ModelProperty('recordHash', 'MD5 hash'),
-        ], linked=[
+        return get_create_model(bf, ds, 'summary', 'Summary', schema=SUMMARY_SCHEMA, linked=[
             LinkedModelProperty('hasAwardNumber', get_bf_model(ds, 'award'), 'Award number'),
-
         ])
 
     def transform(record_id, sub_node, unit_map):
@@ -1327,31 +1425,17 @@ def add_summary(bf, ds, record_cache, sub_node, update_all):
             try:
                 milestoneDate = milestoneDate.isoformat()
             except:
-                log.warning('Cannot parse the Milestone Date: {}'.format(sub_node.get('milestoneCompletionDate')))
+                log.warning('Cannot parse the Milestone Date: %s', sub_node.get('milestoneCompletionDate'))
                 milestoneDate = None
         except:
             milestoneDate = None
 
-        return {
-            'milestoneCompletionDate': milestoneDate,
-            'isDescribedBy': get_as_list(sub_node, 'isDescribedBy'),
-            'acknowledgements': sub_node.get('acknowledgements'),
-            'collectionTitle': sub_node.get('collectionTitle'),
-            'curationIndex': sub_node.get('curationIndex'),
-            'description': get_as_list(sub_node, 'description'),
-            'errorIndex': sub_node.get('errorIndex'),
-            'hasExperimentalModality': get_as_list(sub_node, 'hasExperimentalModality'),
-            'hasNumberOfContributors': sub_node.get('hasNumberOfContributors'),
-            'hasNumberOfDirectories': sub_node.get('hasNumberOfDirectories'),
-            'hasNumberOfFiles': sub_node.get('hasNumberOfFiles'),
-            'hasNumberOfSamples': sub_node.get('hasNumberOfSamples'),
-            'hasNumberOfSubjects': sub_node.get('hasNumberOfSubjects'),
-            'hasSizeInBytes': sub_node.get('hasSizeInBytes'),
-            'label': sub_node.get('label'),
-            'submissionIndex': sub_node.get('submissionIndex'),
-            'title': sub_node.get('title','Title Unknown...'),
-            'recordHash': sub_node.get('hash'),
-        }
+        values = {key: (get_as_list(sub_node, key) if is_list else sub_node.get(key))
+            for key, is_list in SUMMARY_FIELDS}
+        values['milestoneCompletionDate'] = milestoneDate
+        values['title'] = sub_node.get('title','Title Unknown...')
+        values['recordHash'] = sub_node.get('hash')
+        return values
 
     record_list = []
     json_id_list = []
@@ -1361,7 +1445,7 @@ def add_summary(bf, ds, record_cache, sub_node, update_all):
     json_id_list.append("{}".format( 'summary' ))
 
     if len(record_list):
-        log.info('Creating {} new summary Records'.format(len(record_list)))
+        log.info('Creating %s new summary Records', len(record_list))
         model = create_model(bf, ds, None)
         record_cache['summary'].update(zip(json_id_list, model.create_records(record_list)))
 
@@ -1400,54 +1484,83 @@ def add_summary_links(bf, ds, record_cache, sub_node_name, ds_node):
     # Add Property links to model
     model = updateModel(bf, ds)
 
-    record_id = get_record_id_from_node(bf, ds, model, 'summary', sub_node, record_cache  )
+    record = get_record_from_node(bf, ds, model, 'summary', sub_node, record_cache  )
 
-    if record_id:
+    if record:
         # Add Linked Properties
         out = transform(sub_node)
-        add_record_links(bf, ds, record_cache, model, record_id, out['links'], ds_node )
+        add_record_links(bf, ds, record_cache, model, record.id, out['links'], ds_node )
 
         # Add Relationships
         rels = out['relationships']
-        record = model.get(record_id) #TODO update to use ID only
         add_record_relationships(bf, ds, record_cache, model, record, out['relationships'], ds_node)
     else:
-        log.warning('Trying to link to a summary record ({}) that does not exist.'.format( record_id ))
+        log.warning('Trying to link to a summary record that does not exist.')
 
-def add_awards(bf, ds, record_cache, sub_node,update_all):
+def get_award_info(awardId):
+    """Return title, description and principal investigator of an award
 
-    def create_model(bf, ds, unit_map):
-        return get_create_model(bf, ds, 'award', 'Award', schema=[
-            ModelProperty('award_id', 'Award ID', title=True),
-            ModelProperty('title', 'Title'),
-            ModelProperty('description', 'Description'),
-            ModelProperty('principal_investigator', 'Principal Investigator'),
-            ModelProperty('recordHash', 'MD5 hash'),
+    Awards are looked up on federalreporter and the responses are cached on
+    disk. Awards that could not be found, and failed lookups, are cached for
+    a shorter time, so they are not looked up again for every dataset that
+    references them.
 
-        ])
+    Returns None if the award could not be found
+    """
 
-    def transform(record_id, sub_node, unit_map):
-        awardId = sub_node.get('awardId','(Unknown)')
-        r = requests.get(url = u'https://api.federalreporter.nih.gov/v1/projects/search?query=projectNumber:*{}*'.format(awardId))
-        try:
-            data = r.json()
-        except Exception as e:
-            return {
-                'award_id': awardId,
-                'title': None,
-                'description': None,
-                'principal_investigator': None,
-                'recordHash': sub_node.get('hash'),
-            }
+    with award_cache_lock:
+        with shelve.open(AWARD_CACHE_FILE) as cache:
+            entry = cache.get(awardId)
 
+    # Entries fetched from a different endpoint are stale
+    if entry and entry.get('source') == FEDERAL_REPORTER_URL and \
+            time() - entry['fetched_at'] < entry['ttl']:
+        log.debug('Returning cached award: %s', awardId)
+        return entry['info']
+
+    info = None
+    ttl = AWARD_CACHE_MISS_TTL
+    try:
+        r = reporter_session.get(FEDERAL_REPORTER_URL,
+            params={'query': 'projectNumber:*{}*'.format(awardId)}, timeout=10)
+        data = r.json()
         if data['totalCount'] > 0:
-            return {
-                'award_id': awardId,
+            info = {
                 'title': data['items'][0]['title'],
                 'description': data['items'][0]['abstract'],
                 'principal_investigator': data['items'][0]['contactPi'],
-                'recordHash': sub_node.get('hash'),
+            }
+            ttl = AWARD_CACHE_TTL
+    except Exception as e:
+        # Cache failed requests briefly, so an outage is not retried for every award
+        log.warning('Unable to get award %s: %s', awardId, e)
+        ttl = AWARD_CACHE_ERROR_TTL
+
+    with award_cache_lock:
+        with shelve.open(AWARD_CACHE_FILE) as cache:
+            cache[awardId] = {
+                'source': FEDERAL_REPORTER_URL,
+                'fetched_at': time(),
+                'ttl': ttl,
+                'info': info}
+
+    return info
+
+def add_awards(bf, ds, record_cache, sub_node,update_all):
 
+    def create_model(bf, ds, unit_map):
+        return get_create_model(bf, ds, 'award', 'Award', schema=AWARD_SCHEMA)
+
+    def transform(record_id, sub_node, unit_map):
+        awardId = sub_node.get('awardId','(Unknown)')
+        info = award_info[awardId].result()
+        if info:
+            return {
+                'award_id': awardId,
+                'title': info['title'],
+                'description': info['description'],
+                'principal_investigator': info['principal_investigator'],
+                'recordHash': sub_node.get('hash'),
             }
         else:
             return {
@@ -1458,4 +1571,12 @@ def add_awards(bf, ds, record_cache, sub_node,update_all):
                 'recordHash': sub_node.get('hash'),
             }
 
-    update_records(bf, ds, sub_node, "award", record_cache,  create_model, transform, update_all=update_all)
\ No newline at end of file
+    # Look up the awards that will be transformed concurrently, transform only waits for the award it needs
+    award_info = {}
+    with ThreadPoolExecutor(max_workers=AWARD_LOOKUP_WORKERS) as executor:
+        def prefetch(nodes):
+            for awardId in {node.get('awardId','(Unknown)') for node in nodes}:
+                award_info[awardId] = executor.submit(get_award_info, awardId)
+
+        update_records(bf, ds, sub_node, "award", record_cache,  create_model, transform, update_all=update_all,
+            prefetch_fnc=prefetch)
\ No newline at end of file
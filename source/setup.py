@@ -10,7 +10,7 @@ setup(
         'bf_io','config'],
     install_requires=[
         'Click','Pennsieve','beautifulsoup4',
-        'configparser','rdflib',
+        'configparser','ijson','orjson','rdflib',
         'requests','structlog'
     ],
     entry_points='''
@@ -27,7 +27,9 @@ def cli():
 
 @click.command()
 @click.option('-v', '--version', default=0, type=int, help="Provide an offset from latest version (e.g. -1)")
-def ttl_to_json(version):
+@click.option('-w', '--workers', default=1, type=int, help= "Number of processes used to extract records from the TTL file" )
+@click.option('-f', '--force', default=False, type=bool, help= "Rebuild the JSON file even if the TTL file has not changed" )
+def ttl_to_json(version, workers=1, force=False):
     """Get TTL file and convert to JSON.
 
     This script will download the TTL file and convert to the JSON structure that
@@ -38,11 +40,11 @@ def ttl_to_json(version):
     if version == 0:
         log.info("Getting Latest Version")
         metadata_versions.getLatestTTLVersion()
-        new_metadata.buildJson(version)
+        new_metadata.buildJson(version, workers, force)
     elif version < 0:
         log.info("Getting Specific version: {}".format(version))
         out = metadata_versions.getSpecificTTLVersion(version)
-        new_metadata.buildJson(version)
+        new_metadata.buildJson(version, workers, force)
     else:
         log.warning('Incorrect argument for version (version > 0)')
 
@@ -53,7 +55,8 @@ def ttl_to_json(version):
 @click.option('-f', '--force_update', default=False, type=bool, help="Forcing to update all models and records (and rebuild hash table for synchronizing future runs)")
 @click.option('-fm', '--force_model', default='', help= "force updating records for a single model (specify the model name)" )
 @click.option('-r', '--resume', default=False, type=bool, help= "If 'True', then resume synchronizing from previous run. This can be used when the previous run failed to complete."  )
-def update(env, id=None, force_update=False, force_model='', resume=False):
+@click.option('-w', '--workers', default=1, type=int, help= "Number of datasets to synchronize concurrently" )
+def update(env, id=None, force_update=False, force_model='', resume=False, workers=1):
     """Synchronize JSON File and Platform.
 
     This script takes the JSON file that was converted from the TTL file and 
@@ -68,9 +71,9 @@ def update(env, id=None, force_update=False, force_model='', resume=False):
         log.info('Starting UPDATE for: {}'.format(env))
         cfg = Configs(env)
         if id:
-            out = update_datasets(cfg, id[0], force_update, force_model, resume)
+            out = update_datasets(cfg, id[0], force_update, force_model, resume, workers)
         else:
-            out = update_datasets(cfg, 'full', force_update, force_model, resume)
+            out = update_datasets(cfg, 'full', force_update, force_model, resume, workers)
     else:
         log.warning('Incorrect argument (''prod'', ''dev'')')
 